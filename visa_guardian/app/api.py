@@ -3,21 +3,40 @@
 FastAPI service for Immigration Guardian RAG Chatbot
 """
 
-from fastapi import FastAPI, HTTPException
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Dict, Optional
 import uvicorn
 import pathlib
+import orjson
 
-from app.rag_chatbot import ImmigrationRAGChatbot
+from app.rag_chatbot import ImmigrationRAGChatbot, OllamaBatcher, create_http_client
+
+# Initialize chatbot
+chatbot = ImmigrationRAGChatbot()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the shared Ollama HTTP client on startup, close it on shutdown"""
+    chatbot.http = create_http_client()
+    chatbot.batcher = OllamaBatcher(chatbot.http)
+    # Load the index in the background: /health answers right away, the first /chat doesn't pay for it
+    warm_up = asyncio.create_task(asyncio.to_thread(chatbot.warm_up))
+    yield
+    await warm_up
+    await chatbot.batcher.aclose()
+    await chatbot.http.aclose()
 
 app = FastAPI(
     title="Immigration Guardian RAG Chatbot",
     description="AI-powered immigration law assistant using RAG",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -34,9 +53,6 @@ static_path = pathlib.Path(__file__).parent / "static"
 if static_path.exists():
     app.mount("/static", StaticFiles(directory=str(static_path)), name="static")
 
-# Initialize chatbot
-chatbot = ImmigrationRAGChatbot()
-
 class ChatRequest(BaseModel):
     query: str
     model: Optional[str] = "llama3.2:latest"
@@ -60,11 +76,36 @@ async def root():
 async def chat(request: ChatRequest):
     """Chat with the immigration assistant"""
     try:
-        response = chatbot.chat(request.query)
+        response = await chatbot.chat(request.query)
         return ChatResponse(**response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request):
+    """Chat with the immigration assistant, streaming the answer as Server-Sent Events.
+    
+    Emits one `meta` event (visa type, sources, ...), `data` events carrying
+    JSON-encoded answer pieces, then a `done` event.
+    """
+    async def event_stream():
+        stream = chatbot.chat_stream(request.query)
+        try:
+            meta = await stream.__anext__()
+            yield f"event: meta\ndata: {orjson.dumps(meta).decode()}\n\n"
+            async for piece in stream:
+                if await http_request.is_disconnected():
+                    break  # closing the stream below drops the Ollama request
+                yield f"data: {orjson.dumps(piece).decode()}\n\n"
+            else:
+                yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {orjson.dumps(str(e)).decode()}\n\n"
+        finally:
+            await stream.aclose()
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -0,0 +1,38 @@
+# app/onnx_encoder.py
+# int8 ONNX Runtime query encoder, shared by the chatbot and the eval scripts.
+# Only numpy at import time; optimum/transformers load when an encoder is built.
+import pathlib
+from typing import List
+import numpy as np
+
+class OnnxQueryEncoder:
+    """all-MiniLM-L6-v2 on ONNX Runtime with int8 weights.
+    
+    Implements the slice of the SentenceTransformer API used here: mean pooling
+    over the last hidden state, optional L2 normalization, float32 output.
+    """
+    
+    def __init__(self, model_dir: pathlib.Path, max_length: int = 256):
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+        
+        self.tokenizer = AutoTokenizer.from_pretrained(str(model_dir))
+        self.model = ORTModelForFeatureExtraction.from_pretrained(str(model_dir), file_name="model_quantized.onnx")
+        self.max_length = max_length
+    
+    def encode(self, texts: List[str], batch_size: int = 32, normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        """Encode `batch_size` texts per forward pass, so each batch only pads to its own longest text"""
+        texts = list(texts)
+        emb = np.empty((len(texts), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            inputs = self.tokenizer(texts[start:start + batch_size], padding=True, truncation=True,
+                                    max_length=self.max_length, return_tensors="np")
+            hidden = self.model(**inputs).last_hidden_state
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            emb[start:start + batch_size] = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if normalize_embeddings:
+            emb /= np.linalg.norm(emb, axis=1, keepdims=True)
+        return emb
+    
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.config.hidden_size
@@ -4,47 +4,323 @@ Immigration Guardian RAG Chatbot
 Uses FAISS vector search + Ollama LLM for immigration Q&A
 """
 
-import json
+import asyncio
+import functools
+import hashlib
+import mmap
+import os
 import pathlib
 import re
-from typing import List, Dict, Optional
+import threading
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 import numpy as np
 import faiss
+import ahocorasick
+import orjson
+import diskcache
 from sentence_transformers import SentenceTransformer
-import requests
+import httpx
+from app.onnx_encoder import OnnxQueryEncoder
 
 BASE = pathlib.Path(__file__).resolve().parents[1]
 LAWS = BASE / "data" / "laws"
+OLLAMA_URL = "http://localhost:11434/api/generate"
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBED_MODEL_REVISION = os.environ.get("EMBED_MODEL_REVISION") or None
+
+# Batching knobs; OLLAMA_NUM_PARALLEL should match the value `ollama serve` runs with
+OLLAMA_NUM_PARALLEL = int(os.environ.get("OLLAMA_NUM_PARALLEL", "4"))
+BATCH_MAX = int(os.environ.get("BATCH_MAX", "8"))
+# Ollama has no batch endpoint, so each request is still its own POST; waiting only adds latency
+BATCH_WAIT_MS = int(os.environ.get("BATCH_WAIT_MS", "0"))
+EMBED_CACHE_SIZE = int(os.environ.get("EMBED_CACHE_SIZE", "4096"))
+EMBED_CACHE_DIR = os.environ.get("EMBED_CACHE_DIR", str(BASE / ".query_emb_cache"))
+# Written by scripts/export_onnx_encoder.py; used for query encoding when present
+ONNX_ENCODER_DIR = pathlib.Path(os.environ.get("ONNX_ENCODER_DIR", str(BASE / "models" / "minilm-onnx-int8")))
+META_MMAP_MIN_BYTES = 64 * 1024 * 1024  # memory-map meta files at least this big
+CONTEXT_CHARS = 800  # per-source text budget in the LLM prompt
+# A search hit: (index name, row in that index's meta, score)
+Hit = Tuple[str, int, float]
+
+# The API runs one single-vector search per request in worker threads, so OpenMP threads
+# inside FAISS only add contention; raise this for batch workloads (physical cores, not SMT)
+FAISS_OMP_THREADS = int(os.environ.get("FAISS_OMP_THREADS", "1"))
+
+LOW_CONFIDENCE_SCORE = 2  # visa score at or below this (no explicit visa mention) searches the whole corpus
+
+def normalize_query(query: str) -> str:
+    """Cache key for query embeddings: lowercased, whitespace-collapsed"""
+    return re.sub(r"\s+", " ", query.strip().lower())
+
+def create_http_client() -> httpx.AsyncClient:
+    """Shared keep-alive client for Ollama calls (one per process)"""
+    return httpx.AsyncClient(
+        timeout=60,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=32)
+    )
+
+def load_meta(path: pathlib.Path) -> List[Dict]:
+    """Load a faiss_*_meta.json file with orjson, memory-mapping very large ones"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < META_MMAP_MIN_BYTES:
+            return orjson.loads(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf, memoryview(buf) as view:
+            return orjson.loads(view)
+
+def tune_search_params(index):
+    """Set query-time accuracy knobs for approximate indexes (no-op for flat ones)"""
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = 64
+    elif hasattr(index, "nprobe"):
+        index.nprobe = 32
+    return index
+
+def _is_word_char(c: str) -> bool:
+    return c.isalnum() or c == "_"
+
+def build_keyword_automaton(greetings, typos, visa_keywords, visa_mentions, question_keywords) -> ahocorasick.Automaton:
+    """Build one Aho-Corasick automaton over all classifier keywords.
+    
+    Each keyword maps to (keyword, [(bucket, weight), ...], whole_word). Buckets are
+    "greeting", "typo", the visa types and the question types; exact visa mentions
+    weigh 3, everything else 1. Only greetings require word boundaries.
+    """
+    entries: Dict[str, list] = {}
+    for kw in greetings:
+        entries.setdefault(kw, []).append(("greeting", 1))
+    for kw in typos:
+        entries.setdefault(kw, []).append(("typo", 0))
+    for visa, keywords in visa_keywords.items():
+        for kw in keywords:
+            entries.setdefault(kw, []).append((visa, 3 if kw in visa_mentions else 1))
+    for qtype, keywords in question_keywords.items():
+        for kw in keywords:
+            entries.setdefault(kw, []).append((qtype, 1))
+    
+    automaton = ahocorasick.Automaton()
+    for kw, bucket_weights in entries.items():
+        automaton.add_word(kw, (kw, bucket_weights, kw in greetings))
+    automaton.make_automaton()
+    return automaton
+
+class VisaFilter:
+    """Restricts searches on the shared index to the rows tagged with one visa.
+    
+    On HNSW and IVF indexes a walk restricted to a small share of the rows misses
+    true neighbours and can return fewer than k hits, so visas with at most
+    EXACT_MAX_ROWS rows are scored exactly: their vectors are reconstructed once
+    and each query is one matmul + top-k over them. Otherwise FAISS IDSelector
+    search parameters are used, with efSearch/nprobe raised in inverse proportion
+    to the share of rows the visa covers; FAISS builds without them fall back to
+    over-fetching and post-filtering.
+    """
+    
+    OVERFETCH = 4
+    EXACT_MAX_ROWS = 50_000  # 50k x 384 float32 is ~77 MB per visa
+    
+    def __init__(self, index, rows: np.ndarray):
+        self.rows = rows
+        self.vectors = None
+        self.params = None
+        ivf = faiss.try_extract_index_ivf(index)
+        # Flat and SQ indexes scan every selected row anyway, so only ANN indexes need this
+        if (ivf is not None or hasattr(index, "hnsw")) and rows.size <= self.EXACT_MAX_ROWS:
+            if ivf is not None:
+                ivf.make_direct_map()  # IVF indexes can only reconstruct by id with one
+            self.vectors = index.reconstruct_batch(rows)
+            return
+        if hasattr(faiss, "SearchParameters"):
+            scale = index.ntotal / rows.size
+            self.selector = faiss.IDSelectorBatch(rows)  # must outlive params
+            if hasattr(index, "hnsw"):
+                efSearch = int(np.ceil(index.hnsw.efSearch * scale))
+                self.params = faiss.SearchParametersHNSW(sel=self.selector, efSearch=efSearch)
+            elif ivf is not None:
+                nprobe = min(int(np.ceil(ivf.nprobe * scale)), ivf.nlist)
+                self.params = faiss.SearchParametersIVF(sel=self.selector, nprobe=nprobe)
+            else:
+                self.params = faiss.SearchParameters(sel=self.selector)
+    
+    def search(self, index, query_vector: np.ndarray, k: int):
+        if self.vectors is not None:
+            # Inner product, like every index build_faiss.py writes (vectors are L2-normalized)
+            sims = query_vector @ self.vectors.T
+            k = min(k, sims.shape[1])
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            top = np.take_along_axis(top, np.argsort(-np.take_along_axis(sims, top, axis=1), axis=1), axis=1)
+            return np.take_along_axis(sims, top, axis=1), self.rows[top]
+        if self.params is not None:
+            return index.search(query_vector, k, params=self.params)
+        scores, indices = index.search(query_vector, k * self.OVERFETCH)
+        keep = np.isin(indices[0], self.rows)
+        return scores[:, keep][:, :k], indices[:, keep][:, :k]
+
+class OllamaBatcher:
+    """Dispatch /api/generate calls with at most `parallel` in flight against Ollama.
+    
+    Each request is posted as soon as it is dequeued. With `max_wait_ms` > 0,
+    requests arriving within that window (up to `max_batch`) are grouped first;
+    that only pays off against a backend with a real batch endpoint, since every
+    request is still its own POST.
+    """
+    
+    def __init__(self, client: httpx.AsyncClient, max_batch: int = BATCH_MAX,
+                 max_wait_ms: int = BATCH_WAIT_MS, parallel: int = OLLAMA_NUM_PARALLEL):
+        self.client = client
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.semaphore = asyncio.Semaphore(parallel)
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight = set()
+    
+    async def submit(self, payload: Dict) -> httpx.Response:
+        """Queue one request and wait for its response"""
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._dispatch_loop())
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((payload, future))
+        return await future
+    
+    async def stream(self, payload: Dict) -> AsyncIterator[Dict]:
+        """Stream one request's NDJSON chunks as they arrive.
+        
+        Streaming is latency-bound, so it skips the batch window but still counts
+        against the same in-flight limit. Closing the generator early closes the
+        connection, which makes Ollama stop generating.
+        """
+        async with self.semaphore:
+            async with self.client.stream("POST", OLLAMA_URL, json=payload) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if line:
+                        yield orjson.loads(line)
+    
+    async def aclose(self):
+        """Stop the dispatcher and wait for in-flight requests"""
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+    
+    async def _dispatch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Don't await the batch here, so the next one can start filling right away
+            task = asyncio.ensure_future(asyncio.gather(*(self._post(p, f) for p, f in batch)))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+    
+    async def _post(self, payload: Dict, future: asyncio.Future):
+        async with self.semaphore:
+            try:
+                response = await self.client.post(OLLAMA_URL, json=payload)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(response)
 
 class ImmigrationRAGChatbot:
+    # Common typos and abbreviations of visa names
+    TYPO_KEYS = ("f.1", "f1", "f.2", "f2", "hvb", "h1b", "h.1b", "h.4", "h4", "j.1", "j1", "j.2", "j2")
+    
+    # Visa-specific keywords with weights
+    VISA_KEYWORDS = {
+        "F1": ["f-1", "f1", "student", "study", "university", "college", "opt", "cpt", "on-campus", "off-campus", "practical training"],
+        "F2": ["f-2", "f2", "dependent", "spouse", "child", "family"],
+        "H1B": ["h-1b", "h1b", "work", "employment", "specialty", "occupation"],
+        "H4": ["h-4", "h4", "dependent", "spouse", "child", "family"],
+        "J1": ["j-1", "j1", "exchange", "visitor", "research", "scholar"],
+        "J2": ["j-2", "j2", "dependent", "spouse", "child", "family"]
+    }
+    VISA_MENTIONS = frozenset(["f-1", "f1", "f-2", "f2", "h-1b", "h1b", "h-4", "h4", "j-1", "j1", "j-2", "j2"])
+    
+    GREETINGS = ["hi", "hello", "hey", "good morning", "good afternoon", "good evening", "how are you", "what's up"]
+    
+    QUESTION_KEYWORDS = {
+        # Technical/Detailed questions
+        "technical": [
+            "exact", "specific", "precise", "limit", "requirement", "deadline", "timeline",
+            "calculation", "formula", "percentage", "days", "hours", "weeks", "months",
+            "unemployment", "cap", "quota", "prevailing wage", "lca", "i-765", "i-129",
+            "sevis", "ds-2019", "i-20", "ead", "grace period", "extension"
+        ],
+        # Procedural questions
+        "procedural": [
+            "how to", "step by step", "process", "procedure", "apply", "file", "submit",
+            "application", "form", "document", "requirement", "checklist", "timeline",
+            "deadline", "when to", "where to", "what forms", "which form"
+        ],
+        # Emergency/Urgent questions
+        "emergency": [
+            "emergency", "urgent", "immediately", "right now", "today", "tomorrow",
+            "expired", "expiring", "terminated", "laid off", "fired", "lost job",
+            "out of status", "violation", "deportation", "removal", "overstay"
+        ],
+        # Comparison questions
+        "comparison": [
+            "difference between", "vs", "versus", "compare", "similar", "different",
+            "better", "worse", "advantage", "disadvantage", "pros", "cons"
+        ]
+    }
+    
+    # Built once: every keyword above in a single automaton
+    _AUTOMATON = build_keyword_automaton(GREETINGS, TYPO_KEYS, VISA_KEYWORDS, VISA_MENTIONS, QUESTION_KEYWORDS)
+    
     def __init__(self, model_name: str = "llama3.2:latest"):
         """Initialize the RAG chatbot with FAISS indexes and Ollama LLM"""
         self.model_name = model_name
-        self.embedding_model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-        
-        # Load all visa indexes
+        # classify_visa_type, visa_confidence and classify_question_type all run on the
+        # same query per request; scan it once and share the result
+        self._scan_cached = functools.lru_cache(maxsize=1024)(self._scan_keywords)
+        self.http: Optional[httpx.AsyncClient] = None  # set by the API lifespan / CLI
+        self.batcher: Optional[OllamaBatcher] = None
+        if ONNX_ENCODER_DIR.exists():
+            # int8 ONNX Runtime is several times faster than eager PyTorch for single queries on CPU
+            self.embedding_model = OnnxQueryEncoder(ONNX_ENCODER_DIR)
+            embed_backend = "onnx-int8"
+        else:
+            self.embedding_model = SentenceTransformer(EMBED_MODEL, revision=EMBED_MODEL_REVISION)
+            embed_backend = "torch"
+        print(f"Query encoder: {EMBED_MODEL} ({embed_backend})")
+        # Per-instance LRU so repeated questions skip the transformer entirely,
+        # backed by an on-disk cache that survives restarts
+        self._encode_cached = functools.lru_cache(maxsize=EMBED_CACHE_SIZE)(self._encode)
+        self.embedding_cache = diskcache.Cache(EMBED_CACHE_DIR, eviction_policy="least-recently-used")
+        # Model name/revision/backend/dimension are part of the key, so swapping models invalidates old entries
+        self._embed_key_prefix = (f"{EMBED_MODEL}@{EMBED_MODEL_REVISION or 'default'}:{embed_backend}:"
+                                  f"{self.embedding_model.get_sentence_embedding_dimension()}:")
+        # Cached vectors are stored as raw float32 bytes without a per-request cast; check that holds
+        if self.embedding_model.encode(["warmup"]).dtype != np.float32:
+            raise RuntimeError(f"{EMBED_MODEL} does not produce float32 embeddings")
+        
+        # One FAISS index over the whole corpus; visa-specific searches are restricted
+        # to the rows tagged with that visa instead of using separate per-visa indexes.
+        # Loaded on first use (see _get_index), so startup and /health stay fast.
         self.indexes = {}
         self.metas = {}
         self.visa_types = ["F1", "F2", "H1B", "H4", "J1", "J2"]
+        self.visa_filters = {}
+        self._index_paths = {"general": (LAWS / "faiss.index", LAWS / "faiss_meta.json")}
+        self._load_lock = threading.Lock()
         
-        # Load visa-specific indexes
-        for visa in self.visa_types:
-            idx_path = LAWS / f"faiss_{visa}.index"
-            meta_path = LAWS / f"faiss_{visa}_meta.json"
-            
-            if idx_path.exists() and meta_path.exists():
-                self.indexes[visa] = faiss.read_index(str(idx_path))
-                self.metas[visa] = json.load(open(meta_path, encoding="utf-8"))
-                print(f"Loaded {visa} index: {len(self.metas[visa])} documents")
-        
-        # Load general index for fallback
-        general_idx_path = LAWS / "faiss.index"
-        general_meta_path = LAWS / "faiss_meta.json"
-        
-        if general_idx_path.exists() and general_meta_path.exists():
-            self.indexes["general"] = faiss.read_index(str(general_idx_path))
-            self.metas["general"] = json.load(open(general_meta_path, encoding="utf-8"))
-            print(f"Loaded general index: {len(self.metas['general'])} documents")
+        faiss.omp_set_num_threads(FAISS_OMP_THREADS)
         
         # Initialize knowledge base for common technical details
         self.knowledge_base = {
@@ -82,68 +358,30 @@ class ImmigrationRAGChatbot:
     
     def classify_visa_type(self, query: str) -> str:
         """Simple rule-based visa classification with fuzzy matching for typos"""
-        import re
-        from difflib import SequenceMatcher
-        
         query_lower = query.lower()
         
+        hits, found = self._scan_cached(query_lower)
+        
         # More precise greeting detection using word boundaries
-        greeting_patterns = [
-            r'\bhi\b', r'\bhello\b', r'\bhey\b', 
-            r'\bgood morning\b', r'\bgood afternoon\b', r'\bgood evening\b',
-            r'\bhow are you\b', r'\bwhat\'s up\b'
-        ]
-        if any(re.search(pattern, query_lower) for pattern in greeting_patterns):
+        if hits.get("greeting"):
             return "general"
         
-        # Common typos and abbreviations mapping
-        typo_mapping = {
-            "f.1": "f-1", "f.1": "f1", "f1": "f-1", "f1": "f1",
-            "f.2": "f-2", "f.2": "f2", "f2": "f-2", "f2": "f2", 
-            "hvb": "h-1b", "h1b": "h-1b", "h1b": "h1b",
-            "h.1b": "h-1b", "h.1b": "h1b",
-            "h.4": "h-4", "h4": "h-4", "h4": "h4",
-            "j.1": "j-1", "j1": "j-1", "j1": "j1",
-            "j.2": "j-2", "j2": "j-2", "j2": "j2"
-        }
-        
-        # Check for potential typos in the query
-        potential_typos = []
-        for typo, correct in typo_mapping.items():
-            if typo in query_lower:
-                potential_typos.append((typo, correct))
-        
-        # Visa-specific keywords with weights
-        visa_keywords = {
-            "F1": ["f-1", "f1", "student", "study", "university", "college", "opt", "cpt", "on-campus", "off-campus", "practical training"],
-            "F2": ["f-2", "f2", "dependent", "spouse", "child", "family"],
-            "H1B": ["h-1b", "h1b", "work", "employment", "specialty", "occupation"],
-            "H4": ["h-4", "h4", "dependent", "spouse", "child", "family"],
-            "J1": ["j-1", "j1", "exchange", "visitor", "research", "scholar"],
-            "J2": ["j-2", "j2", "dependent", "spouse", "child", "family"]
-        }
-        
-        # Count keyword matches with better scoring
-        scores = {}
-        for visa, keywords in visa_keywords.items():
-            score = 0
-            for keyword in keywords:
-                if keyword in query_lower:
-                    # Give higher weight to exact visa mentions
-                    if keyword in ["f-1", "f1", "f-2", "f2", "h-1b", "h1b", "h-4", "h4", "j-1", "j1", "j-2", "j2"]:
-                        score += 3
-                    else:
-                        score += 1
-            scores[visa] = score
+        # Keyword scores: exact visa mentions weigh 3, topical keywords 1
+        scores = {visa: hits.get(visa, 0) for visa in self.VISA_KEYWORDS}
         
         # Return visa with highest score, or "general" if no clear match
         best_visa = max(scores.items(), key=lambda x: x[1])
         
+        # Check for potential typos in the query (only matters when nothing matched)
+        potential_typos = []
+        if best_visa[1] == 0:
+            potential_typos = [typo for typo in self.TYPO_KEYS if typo in found]
+        
         # If we found potential typos and no clear visa match, suggest clarification
         if potential_typos and best_visa[1] == 0:
             # Create clarification message with more specific suggestions
             suggestions = []
-            for typo, correct in potential_typos:
+            for typo in potential_typos:
                 if "f" in typo.lower():
                     if "1" in typo:
                         suggestions.append("F-1 (student visa)")
@@ -171,62 +409,99 @@ class ImmigrationRAGChatbot:
         
         return best_visa[0] if best_visa[1] > 0 else "general"
     
+    def visa_confidence(self, query: str, visa_type: str) -> int:
+        """Keyword score behind classify_visa_type's pick (3+ means the visa was named)"""
+        return self._scan_cached(query.lower())[0].get(visa_type, 0)
+    
     def classify_question_type(self, query: str) -> str:
         """Classify the type of question to provide better responses"""
-        query_lower = query.lower()
-        
-        # Technical/Detailed questions
-        technical_keywords = [
-            "exact", "specific", "precise", "limit", "requirement", "deadline", "timeline",
-            "calculation", "formula", "percentage", "days", "hours", "weeks", "months",
-            "unemployment", "cap", "quota", "prevailing wage", "lca", "i-765", "i-129",
-            "sevis", "ds-2019", "i-20", "ead", "grace period", "extension"
-        ]
-        
-        # Procedural questions
-        procedural_keywords = [
-            "how to", "step by step", "process", "procedure", "apply", "file", "submit",
-            "application", "form", "document", "requirement", "checklist", "timeline",
-            "deadline", "when to", "where to", "what forms", "which form"
-        ]
-        
-        # Emergency/Urgent questions
-        emergency_keywords = [
-            "emergency", "urgent", "immediately", "right now", "today", "tomorrow",
-            "expired", "expiring", "terminated", "laid off", "fired", "lost job",
-            "out of status", "violation", "deportation", "removal", "overstay"
-        ]
-        
-        # Comparison questions
-        comparison_keywords = [
-            "difference between", "vs", "versus", "compare", "similar", "different",
-            "better", "worse", "advantage", "disadvantage", "pros", "cons"
-        ]
-        
-        # Count matches
-        technical_score = sum(1 for keyword in technical_keywords if keyword in query_lower)
-        procedural_score = sum(1 for keyword in procedural_keywords if keyword in query_lower)
-        emergency_score = sum(1 for keyword in emergency_keywords if keyword in query_lower)
-        comparison_score = sum(1 for keyword in comparison_keywords if keyword in query_lower)
+        hits = self._scan_cached(query.lower())[0]
         
         # Return the highest scoring type
-        scores = {
-            "technical": technical_score,
-            "procedural": procedural_score,
-            "emergency": emergency_score,
-            "comparison": comparison_score
-        }
+        scores = {qtype: hits.get(qtype, 0) for qtype in self.QUESTION_KEYWORDS}
         
         best_type = max(scores.items(), key=lambda x: x[1])
         return best_type[0] if best_type[1] > 0 else "general"
     
-    def search_relevant_docs(self, query: str, visa_type: str, k: int = 5) -> List[Dict]:
-        """Search for relevant documents using FAISS with enhanced retrieval"""
-        if visa_type not in self.indexes:
+    def _scan_keywords(self, query_lower: str) -> Tuple[Dict[str, int], frozenset]:
+        """Single Aho-Corasick pass over the query.
+        
+        Returns per-bucket scores (each distinct keyword counts once) and the set
+        of keywords found. Greetings only count on word boundaries. Results are
+        shared through _scan_cached, so callers must not modify them.
+        """
+        scores: Dict[str, int] = {}
+        found = set()
+        for end, (keyword, buckets, whole_word) in self._AUTOMATON.iter(query_lower):
+            if keyword in found:
+                continue
+            if whole_word:
+                start = end - len(keyword) + 1
+                if (start > 0 and _is_word_char(query_lower[start - 1])) or \
+                        (end + 1 < len(query_lower) and _is_word_char(query_lower[end + 1])):
+                    continue
+            found.add(keyword)
+            for bucket, weight in buckets:
+                scores[bucket] = scores.get(bucket, 0) + weight
+        return scores, frozenset(found)
+    
+    def _get_index(self, name: str = "general"):
+        """Return the named index, loading it and its metadata on first use (None if not built)"""
+        if name in self.indexes:
+            return self.indexes[name]
+        idx_path, meta_path = self._index_paths[name]
+        if not (idx_path.exists() and meta_path.exists()):
+            return None
+        with self._load_lock:
+            if name not in self.indexes:
+                self._load_index(name, idx_path, meta_path)
+        return self.indexes[name]
+    
+    def _load_index(self, name: str, idx_path: pathlib.Path, meta_path: pathlib.Path):
+        # IO_FLAG_MMAP only maps IVF inverted lists; for the flat/HNSW indexes built here it is
+        # a no-op and the codes are read into this process's memory (deferring that to the
+        # first search is the only saving)
+        index = tune_search_params(faiss.read_index(str(idx_path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY))
+        meta = load_meta(meta_path)
+        # build_faiss.py stores a pre-truncated text_ctx for long clauses; fill it in once
+        # for metas written before that, so prompts never slice text per request
+        for doc in meta:
+            if "text_ctx" not in doc and len(doc.get("text") or "") > CONTEXT_CHARS:
+                doc["text_ctx"] = doc["text"][:CONTEXT_CHARS]
+        print(f"Loaded {name} index: {len(meta)} documents")
+        
+        for visa in self.visa_types:
+            rows = np.array([i for i, doc in enumerate(meta) if visa in (doc.get("visa_tags") or [])], dtype="int64")
+            if rows.size:
+                self.visa_filters[visa] = VisaFilter(index, rows)
+                print(f"  {visa}: {rows.size} documents")
+        
+        # Publish the index last: other threads only skip the lock once it is fully set up
+        self.metas[name] = meta
+        self.indexes[name] = index
+    
+    def warm_up(self):
+        """Load the index ahead of the first question (called in the background at API startup)"""
+        self._get_index("general")
+    
+    async def search_relevant_docs(self, query: str, visa_type: str, k: int = 5, fan_out: bool = False) -> List[Hit]:
+        """Search for relevant documents using FAISS with enhanced retrieval.
+        
+        Returns (index name, row, score) hits; callers read only the meta fields
+        they need via self.metas. With fan_out=True the whole corpus is searched
+        instead of only visa_type's documents.
+        """
+        # Index loading, embedding and FAISS search are blocking; keep them off the event loop
+        return await asyncio.to_thread(self._embed_and_search, query, visa_type, k, fan_out)
+    
+    def _embed_and_search(self, query: str, visa_type: str, k: int = 5, fan_out: bool = False) -> List[Hit]:
+        """Blocking part of search_relevant_docs (runs in a worker thread)"""
+        index = self._get_index("general")
+        if index is None or (visa_type != "general" and visa_type not in self.visa_filters):
             return []
         
         # Encode query
-        query_vector = self.embedding_model.encode([query], normalize_embeddings=True).astype("float32")
+        query_vector = self.embed_query(query)
         
         # Search FAISS index with more documents for complex questions
         question_type = self.classify_question_type(query)
@@ -235,34 +510,97 @@ class ImmigrationRAGChatbot:
         else:
             k = 5
         
-        scores, indices = self.indexes[visa_type].search(query_vector, k)
+        if fan_out or visa_type == "general":
+            scores, indices = index.search(query_vector, k)
+        else:
+            scores, indices = self.visa_filters[visa_type].search(index, query_vector, k)
+        hits = [("general", int(i), float(score)) for i, score in zip(indices[0], scores[0])]
         
-        # Get documents with better filtering
-        docs = []
-        for i, score in zip(indices[0], scores[0]):
-            if i >= 0 and score > 0.1:  # Filter out very low relevance scores
-                doc = self.metas[visa_type][i].copy()
-                doc['score'] = float(score)
-                docs.append(doc)
+        # Filter out missing and very low relevance hits
+        return [hit for hit in hits if hit[1] >= 0 and hit[2] > 0.1]
+    
+    def embed_query(self, query: str) -> np.ndarray:
+        """Return the (1, d) float32 query embedding, served from the LRU cache when possible.
         
-        return docs
+        np.frombuffer gives a C-contiguous view of the cached bytes, so FAISS can use it without a copy.
+        """
+        buf = self._encode_cached(normalize_query(query))
+        return np.frombuffer(buf, dtype=np.float32).reshape(1, -1)
+    
+    def _encode(self, norm_query: str) -> bytes:
+        key = self._embed_key_prefix + hashlib.sha256(norm_query.encode("utf-8")).hexdigest()
+        buf = self.embedding_cache.get(key)
+        if buf is None:
+            buf = self.embedding_model.encode([norm_query], normalize_embeddings=True).tobytes()
+            self.embedding_cache.set(key, buf)
+        return buf
     
-    def generate_answer(self, query: str, relevant_docs: List[Dict], visa_type: str = "general") -> str:
+    async def generate_answer(self, query: str, relevant_docs: List[Hit], visa_type: str = "general") -> str:
         """Generate answer using Ollama LLM with enhanced prompts"""
-        if not relevant_docs:
-            if visa_type == "general":
-                return "Hello! I'm your Immigration Guardian. I can help you with questions about F-1, F-2, H-1B, H-4, J-1, and J-2 visa laws and regulations. What would you like to know?"
-            else:
-                return "I don't have enough information to answer that question accurately. Please try rephrasing or ask about a different immigration topic."
+        canned = self.canned_answer(relevant_docs, visa_type)
+        if canned is not None:
+            return canned
         
+        try:
+            response = await self.batcher.submit(self._ollama_payload(self.build_prompt(query, relevant_docs, visa_type)))
+            
+            if response.status_code == 200:
+                result = response.json()
+                return result.get('response', 'Sorry, I encountered an error generating the response.')
+            else:
+                return f"Error: {response.status_code} - {response.text}"
+                
+        except httpx.HTTPError as e:
+            return f"Error connecting to Ollama: {str(e)}"
+    
+    async def stream_answer(self, query: str, relevant_docs: List[Hit], visa_type: str = "general") -> AsyncIterator[str]:
+        """Same as generate_answer, but yields the answer piece by piece as Ollama produces it"""
+        canned = self.canned_answer(relevant_docs, visa_type)
+        if canned is not None:
+            yield canned
+            return
+        
+        payload = self._ollama_payload(self.build_prompt(query, relevant_docs, visa_type), stream=True)
+        try:
+            async for chunk in self.batcher.stream(payload):
+                if chunk.get('response'):
+                    yield chunk['response']
+        except httpx.HTTPStatusError as e:
+            yield f"Error: {e.response.status_code} - {e.response.text}"
+        except httpx.HTTPError as e:
+            yield f"Error connecting to Ollama: {str(e)}"
+    
+    def canned_answer(self, relevant_docs: List[Hit], visa_type: str) -> Optional[str]:
+        """Fixed reply used instead of the LLM when retrieval found nothing"""
+        if relevant_docs:
+            return None
+        if visa_type == "general":
+            return "Hello! I'm your Immigration Guardian. I can help you with questions about F-1, F-2, H-1B, H-4, J-1, and J-2 visa laws and regulations. What would you like to know?"
+        else:
+            return "I don't have enough information to answer that question accurately. Please try rephrasing or ask about a different immigration topic."
+    
+    def _ollama_payload(self, prompt: str, stream: bool = False) -> Dict:
+        return {
+            "model": self.model_name,
+            "prompt": prompt,
+            "stream": stream,
+            "options": {
+                "temperature": 0.2,  # Lower temperature for more factual responses
+                "top_p": 0.9
+            }
+        }
+    
+    def build_prompt(self, query: str, relevant_docs: List[Hit], visa_type: str = "general") -> str:
+        """Build the LLM prompt from the retrieved documents and question type"""
         # Classify question type for better prompting
         question_type = self.classify_question_type(query)
         
         # Create enhanced context from relevant documents
         context_parts = []
-        for i, doc in enumerate(relevant_docs[:5]):  # Use more documents for complex questions
+        for i, (index_name, row, _) in enumerate(relevant_docs[:5]):  # Use more documents for complex questions
+            doc = self.metas[index_name][row]
             title = doc.get('title', 'Unknown')
-            text = doc.get('text', '')[:800]  # Longer context for complex questions
+            text = doc.get('text_ctx') or doc.get('text', '')  # text_ctx is set whenever text is too long
             url = doc.get('url', '')
             section_hint = doc.get('section_hint', '')
             
@@ -385,29 +723,7 @@ IMPORTANT INSTRUCTIONS:
 
 Answer:"""
         
-        try:
-            response = requests.post(
-                "http://localhost:11434/api/generate",
-                json={
-                    "model": self.model_name,
-                    "prompt": prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.2,  # Lower temperature for more factual responses
-                        "top_p": 0.9
-                    }
-                },
-                timeout=60
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result.get('response', 'Sorry, I encountered an error generating the response.')
-            else:
-                return f"Error: {response.status_code} - {response.text}"
-                
-        except requests.exceptions.RequestException as e:
-            return f"Error connecting to Ollama: {str(e)}"
+        return prompt
     
     def inject_knowledge_base(self, query: str, context: str, visa_type: str) -> str:
         """Inject relevant knowledge base information into the context"""
@@ -467,8 +783,38 @@ Answer:"""
         
         return context
     
-    def chat(self, query: str) -> Dict:
+    async def chat(self, query: str) -> Dict:
         """Main chat function with enhanced response structure"""
+        response, relevant_docs = await self._retrieve(query)
+        
+        # Generate answer
+        if response["answer"] is None:
+            response["answer"] = await self.generate_answer(query, relevant_docs, response["visa_type"])
+        
+        return response
+    
+    async def chat_stream(self, query: str) -> AsyncIterator:
+        """Streaming variant of chat.
+        
+        Yields the response dict without its answer first (visa type, sources, ...),
+        then the answer as a sequence of text pieces.
+        """
+        response, relevant_docs = await self._retrieve(query)
+        answer = response.pop("answer")
+        yield response
+        
+        if answer is not None:
+            yield answer
+            return
+        async for piece in self.stream_answer(query, relevant_docs, response["visa_type"]):
+            yield piece
+    
+    async def _retrieve(self, query: str) -> Tuple[Dict, List[Hit]]:
+        """Classification and retrieval shared by chat and chat_stream.
+        
+        Returns the response dict (answer is None unless no LLM call is needed)
+        and the retrieved documents.
+        """
         # Classify visa type
         visa_type = self.classify_visa_type(query)
         
@@ -487,25 +833,25 @@ Answer:"""
                 "answer": clarification_msg,
                 "sources": [],
                 "num_sources": 0
-            }
+            }, []
         
         # Classify question type
         question_type = self.classify_question_type(query)
         
-        # Search for relevant documents
-        relevant_docs = self.search_relevant_docs(query, visa_type)
-        
-        # Generate answer
-        answer = self.generate_answer(query, relevant_docs, visa_type)
+        # Search for relevant documents; when the visa was only inferred from topical
+        # keywords, search the whole corpus rather than trusting the guess
+        fan_out = visa_type in self.visa_types and self.visa_confidence(query, visa_type) <= LOW_CONFIDENCE_SCORE
+        relevant_docs = await self.search_relevant_docs(query, visa_type, fan_out=fan_out)
         
         # Prepare sources for citation with enhanced metadata
         sources = []
-        for doc in relevant_docs[:5]:  # Include more sources for complex questions
+        for index_name, row, score in relevant_docs[:5]:  # Include more sources for complex questions
+            doc = self.metas[index_name][row]
             sources.append({
                 "title": doc.get("title", "Unknown"),
                 "url": doc.get("url", ""),
                 "section_hint": doc.get("section_hint", ""),
-                "score": doc.get("score", 0),
+                "score": score,
                 "visa_tags": doc.get("visa_tags", [])
             })
         
@@ -513,12 +859,12 @@ Answer:"""
             "query": query,
             "visa_type": visa_type,
             "question_type": question_type,
-            "answer": answer,
+            "answer": None,
             "sources": sources,
             "num_sources": len(relevant_docs)
-        }
+        }, relevant_docs
 
-def main():
+async def main():
     """Interactive chat interface"""
     print("🤖 Immigration Guardian RAG Chatbot")
     print("=" * 50)
@@ -527,6 +873,8 @@ def main():
     
     # Initialize chatbot
     chatbot = ImmigrationRAGChatbot()
+    chatbot.http = create_http_client()
+    chatbot.batcher = OllamaBatcher(chatbot.http)
     
     while True:
         try:
@@ -542,7 +890,7 @@ def main():
             print("🤔 Thinking...")
             
             # Get response
-            response = chatbot.chat(query)
+            response = await chatbot.chat(query)
             
             print(f"\n🤖 Assistant: {response['answer']}")
             print(f"\n📋 Detected Visa Type: {response['visa_type']}")
@@ -562,6 +910,9 @@ def main():
             break
         except Exception as e:
             print(f"Error: {str(e)}")
+    
+    await chatbot.batcher.aclose()
+    await chatbot.http.aclose()
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+# scripts/_embed.py
+# Shared encoder loading and index search helpers for the build and eval scripts.
+import functools, importlib.util, os, pathlib, sys
+import numpy as np, faiss, httpx
+
+BASE = pathlib.Path(__file__).resolve().parents[1]
+MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# Written by export_onnx_encoder.py; same override as the chatbot
+ONNX_DIR = pathlib.Path(os.environ.get("ONNX_ENCODER_DIR", str(BASE / "models" / "minilm-onnx-int8")))
+# A running embed_server.py (e.g. http://127.0.0.1:8765) that query encoding is sent to
+EMBED_SERVER_URL = os.environ.get("EMBED_SERVER_URL")
+# Threads for the eval scripts' batched encode/search (the chatbot pins faiss to 1 per request instead)
+EVAL_THREADS = int(os.environ.get("EVAL_THREADS", os.cpu_count() or 4))
+
+class RemoteEncoder:
+    """Query encoder living in embed_server.py; mirrors the encode() calls the scripts make"""
+
+    def __init__(self, url: str):
+        self.client = httpx.Client(base_url=url, timeout=120)
+        r = self.client.get("/health")
+        r.raise_for_status()
+        self.dim = r.json()["dim"]
+
+    def encode(self, texts, normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        r = self.client.post("/encode", json={"texts": list(texts), "normalize_embeddings": normalize_embeddings})
+        r.raise_for_status()
+        return np.frombuffer(r.content, dtype=np.float32).reshape(len(texts), self.dim).copy()
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+def _load_onnx_encoder_module():
+    """app/onnx_encoder.py by path: the scripts don't have the repo root on sys.path, and
+    importing app.rag_chatbot would also load faiss, diskcache and sentence_transformers"""
+    spec = importlib.util.spec_from_file_location("onnx_encoder", BASE / "app" / "onnx_encoder.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+@functools.lru_cache(maxsize=2)
+def get_model(for_queries: bool = False, remote: bool = True, name: str = MODEL):
+    """Load the encoder once per process: fp16 SentenceTransformer on CUDA, fp32 on CPU.
+
+    With for_queries=True the int8 ONNX export is used when it exists, the same
+    encoder the chatbot answers with, so eval numbers match what users get.
+    Corpus embeddings never come from the int8 weights. If EMBED_SERVER_URL is
+    set, query encoding goes to that server and no model is loaded here.
+    On CUDA, encode() returns float16: callers must cast to float32 before
+    handing vectors to faiss or writing them into a float32 buffer.
+    """
+    if for_queries and remote and EMBED_SERVER_URL:
+        try:
+            model = RemoteEncoder(EMBED_SERVER_URL)
+            print(f"Encoder: embed_server at {EMBED_SERVER_URL}")
+            return model
+        except httpx.HTTPError as e:
+            print(f"embed_server at {EMBED_SERVER_URL} unavailable ({e}); loading the model locally")
+    if for_queries and ONNX_DIR.exists():
+        print(f"Encoder: {name} (onnx-int8)")
+        return _load_onnx_encoder_module().OnnxQueryEncoder(ONNX_DIR)
+    import torch
+    from sentence_transformers import SentenceTransformer
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = SentenceTransformer(name, device=device)
+    if device == "cuda":
+        model.half()  # fp16 halves memory traffic, but encode() then returns float16 arrays
+    print(f"Encoder: {name} ({'cuda, fp16' if device == 'cuda' else 'cpu'})")
+    return model
+
+def use_all_cores():
+    """Let faiss and torch spread one batched search/encode over EVAL_THREADS threads"""
+    faiss.omp_set_num_threads(EVAL_THREADS)
+    if "torch" in sys.modules:  # only when get_model() loaded a local torch model
+        sys.modules["torch"].set_num_threads(EVAL_THREADS)
+
+def read_index(path: pathlib.Path):
+    """Open an index with IO_FLAG_MMAP | IO_FLAG_READ_ONLY.
+
+    In faiss 1.8 only IVF inverted lists are actually mapped; flat and HNSW codes
+    are still read into memory, though from the page cache on repeat runs.
+    """
+    return faiss.read_index(str(path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+
+_gpu_res = None
+
+def index_to_gpu(index):
+    """Move a flat or IVF index to GPU 0 when this faiss build has one (HNSW stays on CPU)"""
+    global _gpu_res
+    if faiss.get_num_gpus() == 0 or isinstance(index, faiss.IndexHNSW):
+        return index
+    if _gpu_res is None:
+        _gpu_res = faiss.StandardGpuResources()
+    return faiss.index_cpu_to_gpu(_gpu_res, 0, index)
+
+def search(index, qv, k: int, torch_mm: bool = False):
+    """index.search(qv, k), or with torch_mm one matmul + topk over a flat index's vectors.
+
+    On CPU a single torch matmul can beat IndexFlatIP for small query batches.
+    """
+    if not torch_mm:
+        return index.search(qv, k)
+    if not isinstance(index, faiss.IndexFlat) or index.metric_type != faiss.METRIC_INNER_PRODUCT:
+        raise SystemExit("--torch-mm needs a flat inner-product index (build_faiss*.py --index flat)")
+    import torch
+    corpus = torch.from_numpy(index.reconstruct_n(0, index.ntotal))
+    scores, ids = torch.topk(torch.from_numpy(qv) @ corpus.T, min(k, index.ntotal), dim=1)
+    return scores.numpy(), ids.numpy()
@@ -1,31 +1,95 @@
-import json, pathlib
-import numpy as np, faiss
-from sentence_transformers import SentenceTransformer
+import argparse, os, pathlib
+import numpy as np, faiss, orjson
+from _embed import get_model
 
 BASE = pathlib.Path(__file__).resolve().parents[1]
 LAWS = BASE / "data" / "laws"
 INP = (LAWS / "clauses_dedup.jsonl") if (LAWS / "clauses_dedup.jsonl").exists() else (LAWS / "clauses.jsonl")
 IDX = LAWS / "faiss.index"
 META = LAWS / "faiss_meta.json"
+META_TMP = META.with_suffix(".tmp")  # moved over META only once the index is written
+CHUNK = 1024  # clauses read and encoded per step
+CTX_CHARS = 800  # the chatbot's per-source prompt budget; longer clauses get a pre-truncated text_ctx
+IVF_NLIST = 1024
+IVF_MIN_TRAIN = 39 * IVF_NLIST  # faiss wants ~39 training points per inverted list
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--index", choices=["flat", "sq8", "hnsw", "hnsw-sq8", "ivfpq"], default="hnsw",
+                help="flat = exact search, sq8 = exact search over int8 codes, hnsw = graph ANN, "
+                     "hnsw-sq8 = graph ANN over int8 codes, ivfpq = compressed ANN for large corpora")
+args = ap.parse_args()
+
+def make_index(kind: str, emb: np.ndarray):
+    # All variants use inner product: vectors are L2-normalized, so IP == cosine
+    d = emb.shape[1]
+    if kind == "ivfpq" and len(emb) < IVF_MIN_TRAIN:
+        print(f"Only {len(emb)} vectors (< {IVF_MIN_TRAIN} needed to train IVF{IVF_NLIST}); using hnsw instead")
+        kind = "hnsw"
+    if kind == "ivfpq":
+        index = faiss.index_factory(d, f"IVF{IVF_NLIST},PQ32", faiss.METRIC_INNER_PRODUCT)
+        index.train(emb)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(d, 32, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = 200
+    elif kind == "hnsw-sq8":
+        index = faiss.IndexHNSWSQ(d, faiss.ScalarQuantizer.QT_8bit, 32, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = 200
+        index.train(emb)
+    elif kind == "sq8":
+        # 1 byte per dimension instead of 4: a quarter of the memory bandwidth per scan
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+        index.train(emb)
+    else:
+        index = faiss.IndexFlatIP(d)
+    index.add(emb)
+    # Saved with the chatbot's query-time settings (see tune_search_params), so the
+    # scripts that open this index directly measure the recall users get
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = 64
+    elif hasattr(index, "nprobe"):
+        index.nprobe = 32
+    return index
 
 print(f"Reading corpus from: {INP}")
-docs, texts = [], []
-with open(INP, encoding="utf-8") as f:
-    for line in f:
-        d = json.loads(line)
-        docs.append(d); texts.append(d["text"])
+with open(INP, "rb") as f:
+    n_docs = sum(1 for line in f if line.strip())
+print(f"Found {n_docs} clauses.")
 
-print(f"Loaded {len(texts)} clauses.")
-model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-emb = model.encode(texts, batch_size=64, normalize_embeddings=True)
-emb = np.asarray(emb, dtype="float32")
+model = get_model()
+batch_size = 512 if model.device.type == "cuda" else 64
 
-index = faiss.IndexFlatIP(emb.shape[1])
-index.add(emb)
-faiss.write_index(index, str(IDX))
+# Stream the corpus in chunks straight into one preallocated float32 matrix,
+# writing metadata records as they are read instead of holding every doc in memory
+emb = np.empty((n_docs, model.get_sentence_embedding_dimension()), dtype="float32")
 
-with open(META, "w", encoding="utf-8") as f:
-    json.dump(docs, f)
+def encode_chunk(start: int, texts: list):
+    emb[start:start + len(texts)] = model.encode(texts, batch_size=batch_size, normalize_embeddings=True,
+                                                 convert_to_numpy=True)
+    print(f"  encoded {start + len(texts)}/{n_docs}")
+
+n, start, texts = 0, 0, []
+with open(INP, "rb") as f, open(META_TMP, "wb") as meta_out:
+    meta_out.write(b"[")
+    for line in f:
+        if not line.strip():
+            continue
+        d = orjson.loads(line)
+        if len(d["text"]) > CTX_CHARS:
+            d["text_ctx"] = d["text"][:CTX_CHARS]
+        meta_out.write(b"," if n else b"")
+        meta_out.write(orjson.dumps(d))
+        texts.append(d["text"])
+        n += 1
+        if len(texts) == CHUNK:
+            encode_chunk(start, texts)
+            start, texts = start + len(texts), []
+    if texts:
+        encode_chunk(start, texts)
+    meta_out.write(b"]")
+
+index = make_index(args.index, emb)
+faiss.write_index(index, str(IDX))
+os.replace(META_TMP, META)
 
-print(f"Wrote index -> {IDX}")
+print(f"Wrote {args.index} index -> {IDX}")
 print(f"Wrote metadata -> {META}")
@@ -1,17 +1,45 @@
-import json, pathlib
-import numpy as np, faiss
-from sentence_transformers import SentenceTransformer
+import argparse, math, pathlib
+import numpy as np, faiss, orjson
+from _embed import index_to_gpu, get_model
 
 BASE = pathlib.Path(__file__).resolve().parents[1]
 LAWS = BASE / "data" / "laws"
 INP = (LAWS / "clauses_dedup.jsonl") if (LAWS / "clauses_dedup.jsonl").exists() else (LAWS / "clauses.jsonl")
+IVFPQ_MIN_DOCS = 50_000  # below this a per-visa set is small enough for HNSW over full vectors
 
-def build_for_tag(tag: str):
+def make_index(kind: str, emb: np.ndarray):
+    # Inner product on L2-normalized vectors == cosine
+    d = emb.shape[1]
+    if kind == "ivfpq" and len(emb) <= IVFPQ_MIN_DOCS:
+        print(f"Only {len(emb)} docs (<= {IVFPQ_MIN_DOCS}); using hnsw instead of ivfpq")
+        kind = "hnsw"
+    if kind == "ivfpq":
+        nlist = int(4 * math.sqrt(len(emb)))
+        index = faiss.IndexIVFPQ(faiss.IndexFlatIP(d), d, nlist, d // 4, 8, faiss.METRIC_INNER_PRODUCT)
+        if faiss.get_num_gpus() > 0:
+            # Run the coarse k-means on GPU; the trained index itself stays on CPU
+            gpu_quantizer = index_to_gpu(faiss.IndexFlatIP(d))
+            index.clustering_index = gpu_quantizer
+        index.train(emb)
+        index.add(emb)
+        index.nprobe = 16
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(d, 32, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = 40
+        index.add(emb)
+        index.hnsw.efSearch = 16  # saved with the index, so the eval scripts search with it
+    else:
+        index = faiss.IndexFlatIP(d)
+        index.add(emb)
+    return index
+
+
+def build_for_tag(tag: str, kind: str = "flat"):
     tag_upper = tag.upper()
     docs, texts = [], []
-    with open(INP, encoding="utf-8") as f:
+    with open(INP, "rb") as f:
         for line in f:
-            d = json.loads(line)
+            d = orjson.loads(line)
             vt = set(d.get("visa_tags") or [])
             if tag_upper in vt:
                 docs.append(d)
@@ -19,20 +47,24 @@ def build_for_tag(tag: str):
     if not texts:
         raise SystemExit(f"No documents found for tag {tag_upper}")
     print(f"Building index for {tag_upper}: {len(texts)} docs")
-    model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+    model = get_model()
     emb = model.encode(texts, batch_size=64, normalize_embeddings=True)
     emb = np.asarray(emb, dtype="float32")
     idx_path = LAWS / f"faiss_{tag_upper}.index"
     meta_path = LAWS / f"faiss_{tag_upper}_meta.json"
-    index = faiss.IndexFlatIP(emb.shape[1])
-    index.add(emb)
+    index = make_index(kind, emb)
     faiss.write_index(index, str(idx_path))
-    with open(meta_path, "w", encoding="utf-8") as f:
-        json.dump(docs, f)
-    print(f"Wrote index -> {idx_path}")
+    meta_path.write_bytes(orjson.dumps(docs))
+    print(f"Wrote {type(index).__name__} -> {idx_path}")
     print(f"Wrote meta  -> {meta_path}")
 
 if __name__ == "__main__":
-    import sys
-    tag = sys.argv[1] if len(sys.argv) > 1 else "F2"
-    build_for_tag(tag)
+    ap = argparse.ArgumentParser()
+    ap.add_argument("tags", nargs="*", default=["F2"], metavar="tag")
+    ap.add_argument("--index", choices=["flat", "hnsw", "ivfpq"], default="flat",
+                    help="flat = exact search (keeps eval numbers exact), hnsw = graph ANN, "
+                         f"ivfpq = compressed ANN for sets over {IVFPQ_MIN_DOCS} docs")
+    args = ap.parse_args()
+    # The encoder is loaded once and shared across tags
+    for tag in args.tags:
+        build_for_tag(tag, args.index)
@@ -0,0 +1,44 @@
+# scripts/check_visa_filters.py
+# Compare the chatbot's per-visa filtered search with exact search over each visa's rows.
+# Run from visa_guardian/ (imports the chatbot's VisaFilter):
+#   python -m scripts.check_visa_filters [--queries 200] [--k 8] [--min-recall 0.95]
+import argparse, sys
+import numpy as np, faiss
+from app.rag_chatbot import LAWS, VisaFilter, load_meta, tune_search_params
+
+VISA_TYPES = ["F1", "F2", "H1B", "H4", "J1", "J2"]
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--queries", type=int, default=200, help="number of probe queries")
+ap.add_argument("--k", type=int, default=8, help="hits per search (the chatbot uses 5 or 8)")
+ap.add_argument("--min-recall", type=float, default=0.95, help="exit non-zero if any visa falls below this")
+args = ap.parse_args()
+
+index = tune_search_params(faiss.read_index(str(LAWS / "faiss.index")))
+meta = load_meta(LAWS / "faiss_meta.json")
+ivf = faiss.try_extract_index_ivf(index)
+if ivf is not None:
+    ivf.make_direct_map()
+
+# Probe with stored vectors plus a little noise, so each query lands near (not on) real clauses
+rng = np.random.default_rng(0)
+ids = rng.choice(index.ntotal, min(args.queries, index.ntotal), replace=False)
+qv = index.reconstruct_batch(ids) + rng.normal(scale=0.05, size=(len(ids), index.d))
+qv = (qv / np.linalg.norm(qv, axis=1, keepdims=True)).astype("float32")
+
+print(f"{'visa':<5} {'rows':>7} {'recall@' + str(args.k):>10} {'missing':>8}")
+failed = False
+for visa in VISA_TYPES:
+    rows = np.array([i for i, doc in enumerate(meta) if visa in (doc.get("visa_tags") or [])], dtype="int64")
+    if not rows.size:
+        continue
+    k = min(args.k, rows.size)
+    sims = qv @ index.reconstruct_batch(rows).T
+    truth = rows[np.argsort(-sims, axis=1)[:, :k]]
+    vf = VisaFilter(index, rows)
+    found = np.vstack([vf.search(index, q[None, :], k)[1] for q in qv])  # one query at a time, like the chatbot
+    recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+    missing = int((found < 0).sum())
+    print(f"{visa:<5} {rows.size:>7} {recall:>10.3f} {missing:>8}")
+    failed |= recall < args.min_recall
+sys.exit(1 if failed else 0)
@@ -1,16 +1,17 @@
 # scripts/clean_qna_jsonl.py
-import json, sys, pathlib
+import sys, pathlib
+import orjson
 
 path = pathlib.Path(sys.argv[1])
 seen = set()
 clean = []
-with open(path, encoding="utf-8") as f:
+with open(path, "rb") as f:
     for line in f:
         line = line.strip()
         if not line:
             continue
         try:
-            obj = json.loads(line)
+            obj = orjson.loads(line)
         except Exception:
             continue
         key = (
@@ -24,9 +25,9 @@ with open(path, encoding="utf-8") as f:
         clean.append(obj)
 
 out = path.with_suffix(".clean.jsonl")
-with open(out, "w", encoding="utf-8") as g:
+with open(out, "wb") as g:
     for obj in clean:
-        g.write(json.dumps(obj, ensure_ascii=False) + "\n")
+        g.write(orjson.dumps(obj) + b"\n")
 
 print(f"Input:  {path} ({len(seen)} unique)")
 print(f"Output: {out} ({len(clean)} kept)")
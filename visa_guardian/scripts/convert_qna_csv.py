@@ -1,5 +1,7 @@
 # scripts/convert_qna_csv.py
-import csv, json, sys, pathlib
+import sys, pathlib
+import orjson
+import pandas as pd
 
 if len(sys.argv) < 3:
     print("Usage: python scripts/convert_qna_csv.py <input_csv> <output_jsonl>")
@@ -12,20 +14,18 @@ if not IN.is_absolute():
 OUT = pathlib.Path(sys.argv[2])
 if not OUT.is_absolute():
     OUT = BASE / OUT
+COLS = ["question", "answer", "law_ref", "visa_type", "risk_level", "notes"]
 
-with IN.open(newline="", encoding="utf-8") as f, OUT.open("w", encoding="utf-8") as g:
-    r = csv.DictReader(f)
-    for row in r:
-        if not row.get("question", "").strip():
-            continue
-        rec = {
-            "question": row.get("question", "").strip(),
-            "answer": (row.get("answer", "") or "").strip() or None,
-            "law_ref": (row.get("law_ref", "") or "").strip() or None,
-            "visa_type": (row.get("visa_type", "") or "").strip() or None,
-            "risk_level": (row.get("risk_level", "") or "").strip() or None,
-            "notes": (row.get("notes", "") or "").strip() or None,
-        }
-        g.write(json.dumps(rec, ensure_ascii=False) + "\n")
+# Parse and strip whole columns with pandas' C reader; blank fields become null.
+# Rows with extra fields (e.g. an unquoted comma in notes) keep their first len(header)
+# fields, as csv.DictReader did; index_col=False stops pandas from shifting every column
+# left when the first data row is one of them.
+header = pd.read_csv(IN, nrows=0).columns
+df = pd.read_csv(IN, dtype=str, keep_default_na=False, index_col=False, usecols=range(len(header)))
+df = df.reindex(columns=COLS).fillna("")
+df = df.apply(lambda col: col.str.strip())
+df = df[df["question"] != ""]
+df = df.astype(object).where(df != "", None)
+OUT.write_bytes(b"".join(orjson.dumps(rec) + b"\n" for rec in df.to_dict("records")))
 
 print(f"Wrote → {OUT}")
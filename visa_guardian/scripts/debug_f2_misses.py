@@ -1,46 +1,55 @@
 # scripts/debug_f2_misses.py
-import json, pathlib, re, faiss
-from sentence_transformers import SentenceTransformer
+import pathlib, re, sys, orjson
+from _embed import index_to_gpu, get_model, read_index, search, use_all_cores
 
 BASE = pathlib.Path(__file__).resolve().parents[1]
 LAWS = BASE / "data" / "laws"
 IDX = LAWS / "faiss_F2.index"  # per-visa index
 META = LAWS / "faiss_F2_meta.json"
 QNA = BASE / "data" / "qna" / "f2_qna_50.clean.jsonl"
+TORCH_MM = "--torch-mm" in sys.argv
 
-meta = json.load(open(META, encoding="utf-8"))
-model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-index = faiss.read_index(str(IDX))
+# Meta as parallel per-field lists indexed by row id; the per-doc dicts are dropped
+meta = orjson.loads(META.read_bytes())
+TITLE = [d.get("title","") for d in meta]
+SECTION = [d.get("section_hint","") for d in meta]
+URL = [d.get("url","") for d in meta]
+del meta
+# Lowercased title/section/url per doc, built once instead of on every looks_like call
+HAY = [" ".join([t, s, u]).lower() for t, s, u in zip(TITLE, SECTION, URL)]
+model = get_model(for_queries=True)
+use_all_cores()
+index = read_index(IDX)
+if not TORCH_MM:
+    index = index_to_gpu(index)
 
-def looks_like(doc, law_ref):
+def looks_like(i, law_ref):
     if not law_ref: return False
-    hay = " ".join([doc.get("title",""), doc.get("section_hint",""), doc.get("url","")]).lower()
+    hay = HAY[i]
     ref = law_ref.lower()
     toks = [t for t in re.split(r'[\s,;:()]+', ref) if t]
     return (ref in hay) or sum(t in hay for t in toks) >= 2
 
-def search(q, k=5):
-    qv = model.encode([q], normalize_embeddings=True).astype("float32")
-    s, ids = index.search(qv, k)
-    return [(int(i), float(sv)) for i, sv in zip(ids[0], s[0]) if i >= 0]
+with open(QNA, "rb") as f:
+    data = [orjson.loads(line) for line in f]
+f2 = [ex for ex in data if (ex.get("visa_type") or "").upper() == "F2"]
+
+# Encode and search all F2 questions in one batch each
+qv = model.encode([ex["question"] for ex in f2], batch_size=64, normalize_embeddings=True, convert_to_numpy=True).astype("float32", copy=False)
+S, I = search(index, qv, 5, torch_mm=TORCH_MM)
 
 misses = []
-with open(QNA, encoding="utf-8") as f:
-    for line in f:
-        ex = json.loads(line)
-        if (ex.get("visa_type") or "").upper() != "F2":
-            continue
-        hits = search(ex["question"], 5)
-        ok = any(looks_like(meta[i], ex.get("law_ref","")) for i,_ in hits)
-        if not ok:
-            misses.append((ex, hits))
+for ex, srow, irow in zip(f2, S, I):
+    hits = [(int(i), float(sv)) for i, sv in zip(irow, srow) if i >= 0]
+    ok = any(looks_like(i, ex.get("law_ref","")) for i,_ in hits)
+    if not ok:
+        misses.append((ex, hits))
 
 for ex, hits in misses[:10]:
     print("\nQ:", ex["question"]) 
     print("law_ref:", ex.get("law_ref",""))
     for rank,(i,score) in enumerate(hits,1):
-        d = meta[i]
-        print(f"  [{rank}] {score:.3f} | {d.get('title')} | {d.get('section_hint')}")
-        print("      ", d.get("url"))
+        print(f"  [{rank}] {score:.3f} | {TITLE[i]} | {SECTION[i]}")
+        print("      ", URL[i])
 
-print(f"\nTotal misses: {len(misses)} / {sum(1 for _ in open(QNA, encoding='utf-8'))}")
+print(f"\nTotal misses: {len(misses)} / {len(data)}")
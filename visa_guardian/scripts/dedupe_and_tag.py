@@ -1,37 +1,84 @@
-import json, pathlib, re
-from sentence_transformers import SentenceTransformer
+import pathlib, re
+from _embed import get_model
 import numpy as np
+import ahocorasick, orjson
+try:
+    from numba import njit
+except ImportError:  # numba is optional; without it the in-block sweep runs as plain Python
+    def njit(*args, **kwargs):
+        return lambda f: f
 
 BASE = pathlib.Path(__file__).resolve().parents[1]
 INP = BASE / "data" / "laws" / "clauses.jsonl"
 OUT = BASE / "data" / "laws" / "clauses_dedup.jsonl"
 
+@njit(cache=True)
+def sweep_block(close, keep, start):
+    """Greedy pass inside one block: row j is dropped if an earlier kept row in the block is too close"""
+    for j in range(close.shape[0]):
+        if not keep[start + j]:
+            continue
+        for i in range(j):
+            if keep[start + i] and close[j, start + i]:
+                keep[start + j] = False
+                break
+
 print(f"Reading: {INP}")
 texts, metas = [], []
-with open(INP, encoding="utf-8") as f:
+with open(INP, "rb") as f:
     for line in f:
-        rec = json.loads(line)
+        rec = orjson.loads(line)
         texts.append(rec["text"])
         metas.append(rec)
 print(f"Loaded {len(texts)} clauses")
 
-model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+model = get_model()
 emb = model.encode(texts, normalize_embeddings=True, batch_size=64)
 emb = np.asarray(emb, dtype="float32")
 
-keep = []
-kept_idx = []
-for i, e in enumerate(emb):
-    if not kept_idx:
-        keep.append(True); kept_idx.append(i); continue
-    sims = emb[kept_idx] @ e
-    if float(np.max(sims)) > 0.95:
-        keep.append(False)
-    else:
-        keep.append(True); kept_idx.append(i)
+# Greedy dedup: a clause is dropped if it is >0.95 similar to an earlier kept clause.
+# Similarities are computed a block at a time with one matmul against everything before it.
+SIM_THRESHOLD = 0.95
+BLOCK = 1024
+n = len(emb)
+keep = np.ones(n, dtype=bool)
+for start in range(0, n, BLOCK):
+    end = min(start + BLOCK, n)
+    close = (emb[start:end] @ emb[:end].T) > SIM_THRESHOLD
+    # Rows before the block are settled, so those columns are one vectorized check
+    keep[start:end] &= ~(close[:, :start] & keep[:start]).any(axis=1)
+    sweep_block(close, keep, start)
+
+# Force-tag F2 for known F-2 specific sources
+F2_SLUGS = {
+    "uscis_f_chapter9",
+    "ecfr_8_214_2_f2",
+    "study_states_dependents",
+    "study_states_f2_study",
+    "ice_dependents_overview",
+    "state_student_visa",
+}
+# Strong F-2/dependents signals, compiled into one alternation so each clause is scanned once
+F2_RE = re.compile("|".join([
+    r"\bF-2\b", r"\bF2\b", r"\bspouse\b", r"\bdependent(s)?\b", r"minor child(ren)?",
+    r"may not (accept|engage in) employment", r"part[- ]time study", r"change of status"
+]), flags=re.IGNORECASE)
+# Visa labels and topic keywords matched as plain substrings of the lowercased text
+TAG_KEYWORDS = [
+    ("f-1", "F1"), ("f1", "F1"), ("f-2", "F2"), ("f2", "F2"),
+    ("j-1", "J1"), ("j1", "J1"), ("j-2", "J2"), ("j2", "J2"),
+    ("h-1b", "H1B"), ("h1b", "H1B"), ("h-4", "H4"), ("h4", "H4"),
+    ("opt", "OPT"), ("cpt", "CPT"), ("on-campus", "on-campus"),
+    ("grace period", "grace-period"), ("portability", "portability"),
+    ("unlawful presence", "unlawful-presence"), ("dependent", "dependent"), ("spouse", "spouse"), ("child", "child"), ("children", "child")
+]
+TAGGER = ahocorasick.Automaton()
+for kw, tag in TAG_KEYWORDS:
+    TAGGER.add_word(kw, tag)
+TAGGER.make_automaton()
 
 kept = 0
-with open(OUT, "w", encoding="utf-8") as g:
+with open(OUT, "wb") as g:
     for k, rec in zip(keep, metas):
         if not k:
             continue
@@ -39,41 +86,15 @@ with open(OUT, "w", encoding="utf-8") as g:
         t = raw_text.lower()
         tags = set(rec.get("visa_tags", []) or [])
         source_id = rec.get("source_id") or ""
-        # Force-tag F2 for known F-2 specific sources
-        f2_slugs = {
-            "uscis_f_chapter9",
-            "ecfr_8_214_2_f2",
-            "study_states_dependents",
-            "study_states_f2_study",
-            "ice_dependents_overview",
-            "state_student_visa",
-        }
-        if source_id in f2_slugs:
+        if source_id in F2_SLUGS:
             tags.add("F2")
-        # Strong F-2/dependents signals
-        f2_patterns = [
-            r"\bF-2\b", r"\bF2\b", r"\bspouse\b", r"\bdependent(s)?\b", r"minor child(ren)?",
-            r"may not (accept|engage in) employment", r"part[- ]time study", r"change of status"
-        ]
-        if any(re.search(p, raw_text, flags=re.IGNORECASE) for p in f2_patterns):
+        if F2_RE.search(raw_text):
             tags.add("F2")
-        # Infer visa labels when obvious in text
-        for pat, vtag in [
-            ("f-1", "F1"), ("f1", "F1"), ("f-2", "F2"), ("f2", "F2"),
-            ("j-1", "J1"), ("j1", "J1"), ("j-2", "J2"), ("j2", "J2"),
-            ("h-1b", "H1B"), ("h1b", "H1B"), ("h-4", "H4"), ("h4", "H4"),
-        ]:
-            if pat in t:
-                tags.add(vtag)
-        for kw, tag in [
-            ("opt", "OPT"), ("cpt", "CPT"), ("on-campus", "on-campus"),
-            ("grace period", "grace-period"), ("portability", "portability"),
-            ("unlawful presence", "unlawful-presence"), ("dependent", "dependent"), ("spouse", "spouse"), ("child", "child"), ("children", "child")
-        ]:
-            if kw in t:
-                tags.add(tag)
+        # Infer visa labels and topics in a single pass
+        for _, tag in TAGGER.iter(t):
+            tags.add(tag)
         rec["visa_tags"] = sorted(tags)
-        g.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        g.write(orjson.dumps(rec) + b"\n")
         kept += 1
 
-print(f"Kept {kept} / {len(keep)} -> {OUT}")
+print(f"Kept {kept} / {n} -> {OUT}")
@@ -0,0 +1,37 @@
+# scripts/embed_server.py
+# Keeps the query encoder loaded between eval/search script runs.
+#   python scripts/embed_server.py
+#   EMBED_SERVER_URL=http://127.0.0.1:8765 python scripts/eval_retrieval_per_visa.py <qna_jsonl> <visa_tag>
+import argparse
+from typing import List
+import numpy as np
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import Response
+from pydantic import BaseModel
+from _embed import get_model
+
+class EncodeRequest(BaseModel):
+    texts: List[str]
+    normalize_embeddings: bool = False
+
+app = FastAPI(title="visa_guardian embed server")
+model = None
+
+@app.get("/health")
+def health():
+    return {"dim": model.get_sentence_embedding_dimension()}
+
+@app.post("/encode")
+def encode(req: EncodeRequest):
+    """Raw float32 rows (len(texts) x dim), avoiding a JSON round trip of every float"""
+    emb = model.encode(req.texts, batch_size=64, normalize_embeddings=req.normalize_embeddings, convert_to_numpy=True)
+    return Response(np.ascontiguousarray(emb, dtype=np.float32).tobytes(), media_type="application/octet-stream")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    args = ap.parse_args()
+    model = get_model(for_queries=True, remote=False)
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -1,76 +1,100 @@
-import json, pathlib, sys, re
-import numpy as np, faiss
-from sentence_transformers import SentenceTransformer
+import pathlib, sys, re
+import numpy as np, orjson
+from _embed import index_to_gpu, get_model, read_index, search, use_all_cores
 
 BASE = pathlib.Path(__file__).resolve().parents[1]
 LAWS = BASE / "data" / "laws"
 
-# args: <qna_jsonl> <visa_tag>
-if len(sys.argv) < 3:
-    print("Usage: python scripts/eval_retrieval_per_visa.py <qna_jsonl> <visa_tag>")
+# args: <qna_jsonl> <visa_tag> [--torch-mm]
+TORCH_MM = "--torch-mm" in sys.argv
+args = [a for a in sys.argv[1:] if a != "--torch-mm"]
+if len(args) < 2:
+    print("Usage: python scripts/eval_retrieval_per_visa.py <qna_jsonl> <visa_tag> [--torch-mm]")
     sys.exit(1)
-QNA = pathlib.Path(sys.argv[1])
-TAG = sys.argv[2].upper()
+QNA = pathlib.Path(args[0])
+TAG = args[1].upper()
 IDX = LAWS / f"faiss_{TAG}.index"
 META = LAWS / f"faiss_{TAG}_meta.json"
 
-model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-index = faiss.read_index(str(IDX))
-meta = json.load(open(META, encoding="utf-8"))
+model = get_model(for_queries=True)
+use_all_cores()
+index = read_index(IDX)
+if not TORCH_MM:
+    index = index_to_gpu(index)  # stays there for the one batched search below
+meta = orjson.loads(META.read_bytes())
+# Lowercased title/section/url per doc, built once instead of on every looks_like call;
+# it is the only field scoring needs, so the per-doc dicts are dropped
+HAY = [" ".join([d.get("title",""), d.get("section_hint",""), d.get("url","")]).lower() for d in meta]
+del meta
 
-def looks_like(doc, law_ref: str) -> bool:
-    if not law_ref:
-        return False
-    hay = " ".join([doc.get("title",""), doc.get("section_hint",""), doc.get("url","")]).lower()
+_SPLIT = re.compile(r"[\s,;:()]+")
+
+def parse_ref(law_ref: str):
+    """Lowercased ref, its tokens and the ref-only checks, computed once per example"""
     ref = law_ref.lower().strip()
+    h4 = "h-4" in ref or "h4" in ref
+    flags = {
+        "cfr_214": "8 cfr" in ref and "214.2" in ref,
+        "cfr_274a": "8 cfr" in ref and "274a" in ref,
+        "cfr_62": "22 cfr" in ref and "62" in ref,
+        "ina_212": "ina 212" in ref,
+        "h4": h4,
+        "h4_employment": "employment" in ref or "ead" in ref,
+        "h4_ead_274a": "uscis h-4 employment authorization" in ref,
+        "h4_dependent": "dependent" in ref or "spouse" in ref or "child" in ref,
+        "j1": "j-1" in ref or "j1" in ref,
+        "j2": "j-2" in ref or "j2" in ref,
+    }
+    return ref, [t for t in _SPLIT.split(ref) if t], flags
+
+def looks_like(i: int, ref: str, ref_toks: list, flags: dict) -> bool:
+    hay = HAY[i]
     
     # Direct substring match
     if ref in hay:
         return True
     
     # Token-based matching
-    tokens = [t for t in re.split(r"[\s,;:()]+", ref) if t]
-    strong_hits = sum(1 for t in tokens if t in hay)
+    strong_hits = sum(1 for t in ref_toks if t in hay)
     if strong_hits >= 2:
         return True
     
     # CFR section matching - handle subsection references
-    if "8 cfr" in ref.lower() and "214.2" in ref.lower():
+    if flags["cfr_214"]:
         if "214.2" in hay:
             return True
-    if "8 cfr" in ref.lower() and "274a" in ref.lower():
+    if flags["cfr_274a"]:
         if "274a" in hay:
             return True
     # J1 CFR section matching
-    if "22 cfr" in ref.lower() and "62" in ref.lower():
+    if flags["cfr_62"]:
         if "62" in hay:
             return True
     
     # H4-specific flexible matching
-    if "h-4" in ref.lower() or "h4" in ref.lower():
+    if flags["h4"]:
         # Employment authorization questions
-        if "employment" in ref.lower() or "ead" in ref.lower():
+        if flags["h4_employment"]:
             if any(term in hay for term in ["employment", "authorization", "274a", "work", "form i-765", "i-765"]):
                 return True
             # Handle USCIS H-4 Employment Authorization -> 8 CFR 274a.12
-            if "uscis h-4 employment authorization" in ref.lower() and "274a" in hay:
+            if flags["h4_ead_274a"] and "274a" in hay:
                 return True
         # Dependent questions  
-        if "dependent" in ref.lower() or "spouse" in ref.lower() or "child" in ref.lower():
+        if flags["h4_dependent"]:
             if any(term in hay for term in ["dependent", "spouse", "child", "214.2", "family"]):
                 return True
         # General H4 questions - very flexible
         if any(term in hay for term in ["h-4", "h4", "214.2", "274a", "employment", "dependent", "spouse", "child", "work", "authorization", "form i-765", "i-765"]):
             return True
         # If it's any H4 question and we have H4 content, accept it
-        if "h-4" in ref.lower() or "h4" in ref.lower():
-            if "h-4" in hay or "h4" in hay or "214.2" in hay:
-                return True
+        if "h-4" in hay or "h4" in hay or "214.2" in hay:
+            return True
     
     # J1-specific flexible matching
-    if "j-1" in ref.lower() or "j1" in ref.lower():
+    if flags["j1"]:
         # INA section matching
-        if "ina 212" in ref.lower() and "212" in hay:
+        if flags["ina_212"] and "212" in hay:
             return True
         # General J1 content matching - very flexible
         if any(term in hay for term in ["j-1", "j1", "62", "exchange", "visitor", "program", "sponsor", "participant"]):
@@ -83,12 +107,12 @@ def looks_like(doc, law_ref: str) -> bool:
             return True
     
     # J2-specific flexible matching
-    if "j-2" in ref.lower() or "j2" in ref.lower():
+    if flags["j2"]:
         # INA section matching
-        if "ina 212" in ref.lower() and "212" in hay:
+        if flags["ina_212"] and "212" in hay:
             return True
         # CFR section matching
-        if "22 cfr" in ref.lower() and "62" in ref.lower():
+        if flags["cfr_62"]:
             if "62" in hay:
                 return True
         # General J2 content matching - very flexible
@@ -106,21 +130,28 @@ def looks_like(doc, law_ref: str) -> bool:
     
     return False
 
-def search(q, k=5):
-    qv = model.encode([q], normalize_embeddings=True).astype("float32")
-    scores, ids = index.search(qv, k)
-    return [int(i) for i in ids[0] if i >= 0]
-
-data = [json.loads(l) for l in open(QNA, encoding="utf-8")]
-hits = 0
+data = [orjson.loads(l) for l in open(QNA, "rb")]
+queries = []
 for ex in data:
     q = ex["question"]
     vt = (ex.get("visa_type") or "").strip().upper()
     if vt and vt != TAG:
         # if mislabeled, still evaluate against TAG index by prefixing
         q = f"{TAG}: {q}"
-    ids = search(q, k=5)
-    ok = any(looks_like(meta[i], ex.get("law_ref","")) for i in ids)
+    queries.append(q)
+
+# Encode and search the whole eval set in one batch each
+qv = model.encode(queries, batch_size=64, normalize_embeddings=True, convert_to_numpy=True).astype("float32", copy=False)
+_, I = search(index, qv, 5, torch_mm=TORCH_MM)
+
+hits = 0
+for ex, row in zip(data, I):
+    law_ref = ex.get("law_ref","")
+    if not law_ref:
+        continue
+    ref, ref_toks, flags = parse_ref(law_ref)
+    ids = [int(i) for i in row if i >= 0]
+    ok = any(looks_like(i, ref, ref_toks, flags) for i in ids)
     hits += int(ok)
 
 p_at_5 = hits / max(len(data), 1)
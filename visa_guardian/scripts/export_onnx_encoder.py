@@ -0,0 +1,29 @@
+# scripts/export_onnx_encoder.py
+# Export all-MiniLM-L6-v2 to ONNX and quantize it to int8 for query-time encoding.
+# The chatbot picks up models/minilm-onnx-int8/ automatically when it exists.
+import argparse, pathlib
+from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+from optimum.onnxruntime.configuration import AutoQuantizationConfig
+from transformers import AutoTokenizer
+
+BASE = pathlib.Path(__file__).resolve().parents[1]
+MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EXPORT_DIR = BASE / "models" / "minilm-onnx"
+OUT_DIR = BASE / "models" / "minilm-onnx-int8"
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--arch", choices=["avx512_vnni", "avx512", "avx2", "arm64"], default="avx512_vnni",
+                help="CPU instruction set to tune the int8 kernels for")
+args = ap.parse_args()
+
+tokenizer = AutoTokenizer.from_pretrained(MODEL)
+model = ORTModelForFeatureExtraction.from_pretrained(MODEL, export=True)
+model.save_pretrained(EXPORT_DIR)
+tokenizer.save_pretrained(EXPORT_DIR)
+print(f"Exported ONNX model -> {EXPORT_DIR}")
+
+# Dynamic quantization: weights stored as int8, activations quantized on the fly
+qconfig = getattr(AutoQuantizationConfig, args.arch)(is_static=False, per_channel=False)
+ORTQuantizer.from_pretrained(model).quantize(save_dir=OUT_DIR, quantization_config=qconfig)
+tokenizer.save_pretrained(OUT_DIR)
+print(f"Wrote int8 model -> {OUT_DIR}")
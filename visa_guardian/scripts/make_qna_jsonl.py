@@ -1,21 +1,21 @@
 # scripts/make_qna_jsonl.py
-import csv, json, pathlib
+import pathlib
+import orjson
+import pandas as pd
 
 BASE = pathlib.Path(__file__).resolve().parents[1]
 IN = BASE / "data" / "qna" / "qna_seed.csv"
 OUT = BASE / "data" / "qna" / "qna.jsonl"
 
-with open(IN, newline="", encoding="utf-8") as f, open(OUT, "w", encoding="utf-8") as g:
-    r = csv.DictReader(f)
-    for row in r:
-        rec = {
-            "question": row["question"].strip(),
-            "answer": row["answer"].strip(),
-            "law_ref": row["law_ref"].strip(),
-            "visa_type": row["visa_type"].strip(),
-            "risk_level": row.get("risk_level", "").strip() or None,
-            "notes": row.get("notes", "").strip() or None,
-        }
-        g.write(json.dumps(rec, ensure_ascii=False) + "\n")
+# Extra fields (an unquoted comma in notes) are dropped past the header, as csv.DictReader
+# did; index_col=False keeps pandas from shifting columns when the first row has one
+header = pd.read_csv(IN, nrows=0).columns
+df = pd.read_csv(IN, dtype=str, keep_default_na=False, index_col=False, usecols=range(len(header))).fillna("")
+df = df.reindex(columns=["question", "answer", "law_ref", "visa_type", "risk_level", "notes"], fill_value="")
+df = df.apply(lambda col: col.str.strip()).astype(object)
+# risk_level/notes are optional: blank -> null (the other fields stay strings)
+for col in ("risk_level", "notes"):
+    df[col] = df[col].where(df[col] != "", None)
+OUT.write_bytes(b"".join(orjson.dumps(rec) + b"\n" for rec in df.to_dict("records")))
 
 print(f"Wrote → {OUT}")
@@ -1,14 +1,14 @@
 import json, pathlib, sys
-import numpy as np, faiss
-from sentence_transformers import SentenceTransformer
+import numpy as np
+from _embed import get_model, read_index
 
 BASE = pathlib.Path(__file__).resolve().parents[1]
 LAWS = BASE / "data" / "laws"
 IDX = LAWS / "faiss.index"
 META = LAWS / "faiss_meta.json"
 
-model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-index = faiss.read_index(str(IDX))
+model = get_model(for_queries=True)
+index = read_index(IDX)
 meta = json.load(open(META, encoding="utf-8"))
 
 def search(q, k=5):